@@ -1,60 +1,171 @@
+import contextlib
+import csv
+import os
 import streamlit as st
+import joblib
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import sklearn
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
 
 # --- Page Configuration ---
 st.set_page_config(page_title="Personal Fitness Tracker", layout="wide")
 
+# --- Constants ---
+DURATIONS = (10, 20, 30, 40, 50, 60)
+HEART_RATES = (60, 90, 120, 150, 180)
+BODY_TEMPS = (36.0, 37.0, 38.0, 39.0, 40.0, 41.0, 42.0)
+EXERCISE_TYPES = ("Running", "Walking", "Cycling", "Swimming", "Weight Training")
+SLEEP_QUALITIES = (1, 2, 3, 4, 5)
+
+FEATURE_COLUMNS = ("Age", "BMI", "Duration", "Heart_Rate", "Body_Temp", "Gender_Male")
+CALORIES_DATASET = "calories.csv"
+EXERCISE_DATASET = "exercise.csv"
+MODEL_FILE = "rf_model.joblib"
+# Bump whenever the training preprocessing (BMI, gender encoding, ...) changes so saved models are retrained
+MODEL_VERSION = 1
+
+CALORIE_FILE = "calorie_data.csv"
+CALORIE_COLUMNS = ('date', 'calories_consumed', 'calories_burned')
+EXERCISE_FILE = "exercise_data.csv"
+EXERCISE_COLUMNS = ('date', 'exercise_type', 'duration')
+WATER_FILE = "water_data.csv"
+WATER_COLUMNS = ('date', 'glasses')
+SLEEP_FILE = "sleep_data.csv"
+SLEEP_COLUMNS = ('date', 'hours_slept', 'sleep_quality')
+
 # --- Helper Functions ---
 def calculate_bmi(height, weight):
-    return weight / (height / 100) ** 2 if height > 0 else 0
+    # Works on a single profile or on whole columns; a height of 0 gives a BMI of 0
+    height_m = np.asarray(height, dtype=np.float64) * 0.01
+    return np.divide(weight, height_m * height_m, out=np.zeros_like(height_m), where=height_m > 0)
+
+_BMI_EDGES = np.array([18.5, 25.0, 30.0])
+_BMI_LABELS = np.array(["Underweight", "Normal weight", "Overweight", "Obese"])
 
 def get_bmi_category(bmi):
-    if bmi < 18.5:
-        return "Underweight"
-    elif 18.5 <= bmi < 24.9:
-        return "Normal weight"
-    elif 25 <= bmi < 29.9:
-        return "Overweight"
-    else:
-        return "Obese"
+    # Works on a single BMI or on a whole array of them
+    return _BMI_LABELS[np.searchsorted(_BMI_EDGES, bmi, side="right")]
 
-def save_data(file_name, data):
-    data.to_csv(file_name, index=False)
+def append_row(file_name, columns, row_dict):
+    with open(file_name, "a", newline="") as f:
+        writer = csv.writer(f)
+        if f.tell() == 0:
+            writer.writerow(columns)
+        writer.writerow([row_dict[column] for column in columns])
 
-def load_data(file_name, default_columns):
+def _load_csv_uncached(file_name, default_columns, parse_dates=None):
     try:
-        return pd.read_csv(file_name)
+        return pd.read_csv(file_name, parse_dates=parse_dates)
     except FileNotFoundError:
         return pd.DataFrame(columns=default_columns)
 
+def file_mtime(file_name):
+    return os.path.getmtime(file_name) if os.path.exists(file_name) else 0
+
+def file_signature(file_name):
+    # Logs are append-only, so the size changes on every write even if the mtime tick doesn't
+    try:
+        stat = os.stat(file_name)
+    except FileNotFoundError:
+        return (0, 0)
+    return (stat.st_mtime_ns, stat.st_size)
+
+@st.cache_data(max_entries=4)
+def load_data(file_name, default_columns, signature, parse_dates=None):
+    # signature is only used as a cache key so the cache refreshes whenever the file is written
+    return _load_csv_uncached(file_name, default_columns, parse_dates)
+
+# --- Chart Builders ---
+# Each builder is cached on the signature of its log file and returns None when there is nothing to plot.
+# Only the latest version of each log is worth keeping, so older figures are evicted.
+@st.cache_data(max_entries=1)
+def build_calorie_fig(signature):
+    calorie_data = load_data(CALORIE_FILE, CALORIE_COLUMNS, signature, parse_dates=['date'])
+    if calorie_data.empty:
+        return None
+    return px.line(calorie_data, x='date', y=['calories_consumed', 'calories_burned'], 
+                   title="Calorie Tracking Over Time", markers=True)
+
+@st.cache_data(max_entries=1)
+def build_exercise_fig(signature):
+    exercise_data = load_data(EXERCISE_FILE, EXERCISE_COLUMNS, signature, parse_dates=['date'])
+    if exercise_data.empty:
+        return None
+    return px.bar(exercise_data, x='date', y='duration', color='exercise_type', 
+                  title="Exercise Duration Over Time")
+
+@st.cache_data(max_entries=1)
+def build_water_fig(signature):
+    water_data = load_data(WATER_FILE, WATER_COLUMNS, signature, parse_dates=['date'])
+    if water_data.empty:
+        return None
+    return px.line(water_data, x='date', y='glasses', 
+                   title="Water Intake Over Time", markers=True)
+
+@st.cache_data(max_entries=1)
+def build_sleep_figs(signature):
+    sleep_data = load_data(SLEEP_FILE, SLEEP_COLUMNS, signature, parse_dates=['date'])
+    if sleep_data.empty:
+        return None
+    fig_hours = px.line(sleep_data, x='date', y='hours_slept', 
+                        title="Sleep Duration Over Time", markers=True, 
+                        labels={"hours_slept": "Hours Slept"})
+    fig_quality = px.line(sleep_data, x='date', y='sleep_quality', 
+                          title="Sleep Quality Over Time", markers=True, 
+                          labels={"sleep_quality": "Quality (1-5)"})
+    return fig_hours, fig_quality
+
 @st.cache_resource
 def prepare_model():
+    model = RandomForestRegressor(n_estimators=100, max_depth=6, n_jobs=-1, random_state=1)
+    # Everything besides the training data that a saved model has to match to be reused
+    model_key = (MODEL_VERSION, FEATURE_COLUMNS, model.get_params(), sklearn.__version__)
+
+    # Reuse the model saved by an earlier run unless the training data or the model setup has changed since
+    if file_mtime(MODEL_FILE) > max(file_mtime(CALORIES_DATASET), file_mtime(EXERCISE_DATASET)):
+        try:
+            saved_key, saved_model, saved_columns = joblib.load(MODEL_FILE)
+            if saved_key == model_key:
+                return saved_model, saved_columns
+        except Exception:
+            # A truncated, corrupt or incompatible file just means training again
+            pass
+
     # Load datasets
-    calories = pd.read_csv("calories.csv")
-    exercise = pd.read_csv("exercise.csv")
+    calories = pd.read_csv(CALORIES_DATASET)
+    exercise = pd.read_csv(EXERCISE_DATASET)
     data = exercise.merge(calories, on="User_ID")
-    data["BMI"] = data["Weight"] / ((data["Height"] / 100) ** 2)
+    data["BMI"] = calculate_bmi(data["Height"].to_numpy(), data["Weight"].to_numpy())
     
     # Handle Gender encoding
-    data = pd.get_dummies(data, columns=["Gender"], drop_first=False)
-    
-    # Ensure the Gender_Male column exists
-    if "Gender_Male" not in data.columns:
-        data["Gender_Male"] = 0
+    data["Gender_Male"] = (data["Gender"].str.lower() == "male").to_numpy(dtype=np.uint8)
 
     # Features and Labels
-    X = data[["Age", "BMI", "Duration", "Heart_Rate", "Body_Temp", "Gender_Male"]]
+    # Features in float32, the dtype sklearn's tree code works in, so fit() needs no conversion copy of X
+    X = data[list(FEATURE_COLUMNS)].astype(np.float32)
     y = data["Calories"]
     
     # Train-Test Split
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=1)
     
     # Train Model
-    model = RandomForestRegressor(n_estimators=1000, max_depth=6, random_state=1)
-    model.fit(X_train, y_train)
+    # Fit on plain arrays so predict() can be given a NumPy row without feature-name checks
+    model.fit(X_train.to_numpy(), y_train.to_numpy())
+    # Threads only pay off for fit; a single-row predict is faster walking the trees serially
+    model.set_params(n_jobs=1)
+
+    # Dump to a temp file first so an interrupted save never leaves a truncated model behind
+    tmp_file = f"{MODEL_FILE}.{os.getpid()}.tmp"
+    try:
+        joblib.dump((model_key, model, X.columns), tmp_file, compress=3)
+        os.replace(tmp_file, MODEL_FILE)
+    except OSError:
+        # Saving only speeds up the next cold start, so e.g. a read-only directory is not fatal
+        with contextlib.suppress(OSError):
+            os.remove(tmp_file)
     return model, X.columns
 
 # --- Initialize Model ---
@@ -79,8 +190,9 @@ with profile_tab:
         age = st.number_input("Age", min_value=15, max_value=100)
     
     if st.button("Update Profile"):
-        bmi = calculate_bmi(height, weight)
+        bmi = float(calculate_bmi(height, weight))
         st.session_state.profile = {"gender": gender, "height": height, "weight": weight, "age": age, "bmi": bmi}
+        st.session_state.pop("prediction", None)
         st.success("Profile Updated!")
     
     if "profile" in st.session_state:
@@ -99,60 +211,54 @@ with tracking_tab:
             st.subheader("Predict Calories Burned")
             
             # Replace sliders with dropdowns
-            duration = st.selectbox("Select Duration (in minutes):", [10, 20, 30, 40, 50, 60])
-            heart_rate = st.selectbox("Select Heart Rate (bpm):", [60, 90, 120, 150, 180])
-            body_temp = st.selectbox("Select Body Temperature (°C):", [36.0, 37.0, 38.0, 39.0, 40.0, 41.0, 42.0])
+            with st.form("calorie_form"):
+                duration = st.selectbox("Select Duration (in minutes):", DURATIONS)
+                heart_rate = st.selectbox("Select Heart Rate (bpm):", HEART_RATES)
+                body_temp = st.selectbox("Select Body Temperature (°C):", BODY_TEMPS)
+                submit_prediction = st.form_submit_button("Predict")
             
-            user_data = pd.DataFrame([{
-                "Age": st.session_state.profile["age"],
-                "BMI": st.session_state.profile["bmi"],
-                "Duration": duration,
-                "Heart_Rate": heart_rate,
-                "Body_Temp": body_temp,
-                "Gender_Male": 1 if st.session_state.profile['gender'] == "Male" else 0
-            }], columns=feature_columns)
+            if submit_prediction:
+                features = {
+                    "Age": st.session_state.profile["age"],
+                    "BMI": st.session_state.profile["bmi"],
+                    "Duration": duration,
+                    "Heart_Rate": heart_rate,
+                    "Body_Temp": body_temp,
+                    "Gender_Male": 1 if st.session_state.profile['gender'] == "Male" else 0
+                }
+                user_data = np.array([[features[column] for column in feature_columns]], dtype=np.float32)
+                # Kept in session state so the log button still has it on the rerun its click triggers
+                st.session_state.prediction = model.predict(user_data)[0]
             
-            prediction = model.predict(user_data)[0]
-            st.metric("Predicted Calories Burned", f"{prediction:.2f} kcal")
-            
-            # Save predicted data
-            if st.button("Log Calories Burned"):
-                calorie_file = "calorie_data.csv"
-                calorie_columns = ['date', 'calories_consumed', 'calories_burned']
-                
-                calorie_data = load_data(calorie_file, calorie_columns)
+            if "prediction" in st.session_state:
+                prediction = st.session_state.prediction
+                st.metric("Predicted Calories Burned", f"{prediction:.2f} kcal")
                 
-                # Add new entry
-                new_row = {"date": pd.Timestamp.now(), "calories_consumed": 0, "calories_burned": prediction}
-                calorie_data = pd.concat([calorie_data, pd.DataFrame([new_row])], ignore_index=True)
-                save_data(calorie_file, calorie_data)
-                st.success("Calories burned logged successfully!")
+                # Save predicted data
+                if st.button("Log Calories Burned"):
+                    # Add new entry
+                    new_row = {"date": pd.Timestamp.now(), "calories_consumed": 0, "calories_burned": prediction}
+                    append_row(CALORIE_FILE, CALORIE_COLUMNS, new_row)
+                    st.success("Calories burned logged successfully!")
         
         # Exercise Tracking
         with track_tabs[1]:
             st.subheader("Log Exercise Data")
-            exercise_file = "exercise_data.csv"
-            exercise_columns = ['date', 'exercise_type', 'duration']
-            exercise_data = load_data(exercise_file, exercise_columns)
             
             with st.form("exercise_form"):
                 exercise_date = st.date_input("Date", value=pd.Timestamp.now())
-                exercise_type = st.selectbox("Exercise Type", ["Running", "Walking", "Cycling", "Swimming", "Weight Training"])
+                exercise_type = st.selectbox("Exercise Type", EXERCISE_TYPES)
                 duration = st.number_input("Duration (minutes)", min_value=0)
                 submit_exercise = st.form_submit_button("Log Exercise")
             
             if submit_exercise:
                 new_row = {'date': exercise_date, 'exercise_type': exercise_type, 'duration': duration}
-                exercise_data = pd.concat([exercise_data, pd.DataFrame([new_row])], ignore_index=True)
-                save_data(exercise_file, exercise_data)
+                append_row(EXERCISE_FILE, EXERCISE_COLUMNS, new_row)
                 st.success("Exercise Data Logged Successfully!")
         
         # Water Intake Tracking
         with track_tabs[2]:
             st.subheader("Log Water Intake")
-            water_file = "water_data.csv"
-            water_columns = ['date', 'glasses']
-            water_data = load_data(water_file, water_columns)
             
             with st.form("water_form"):
                 water_date = st.date_input("Date", value=pd.Timestamp.now())
@@ -161,27 +267,22 @@ with tracking_tab:
             
             if submit_water:
                 new_row = {'date': water_date, 'glasses': glasses}
-                water_data = pd.concat([water_data, pd.DataFrame([new_row])], ignore_index=True)
-                save_data(water_file, water_data)
+                append_row(WATER_FILE, WATER_COLUMNS, new_row)
                 st.success("Water Intake Logged Successfully!")
         
         # Sleep Monitoring
         with track_tabs[3]:
             st.subheader("Log Sleep Data")
-            sleep_file = "sleep_data.csv"
-            sleep_columns = ["date", "hours_slept", "sleep_quality"]
-            sleep_data = load_data(sleep_file, sleep_columns)
             
             with st.form("sleep_form"):
                 sleep_date = st.date_input("Date", value=pd.Timestamp.now())
                 sleep_duration = st.number_input("Hours Slept", min_value=0.0, max_value=24.0, step=0.5)
-                sleep_quality = st.radio("Sleep Quality (1 = Poor, 5 = Excellent):", [1, 2, 3, 4, 5])
+                sleep_quality = st.radio("Sleep Quality (1 = Poor, 5 = Excellent):", SLEEP_QUALITIES)
                 submit_sleep = st.form_submit_button("Log Sleep Data")
             
             if submit_sleep:
                 new_row = {"date": sleep_date, "hours_slept": sleep_duration, "sleep_quality": sleep_quality}
-                sleep_data = pd.concat([sleep_data, pd.DataFrame([new_row])], ignore_index=True)
-                save_data(sleep_file, sleep_data)
+                append_row(SLEEP_FILE, SLEEP_COLUMNS, new_row)
                 st.success("Sleep Data Logged Successfully!")
 
 # --- Progress Tab ---
@@ -189,58 +290,35 @@ with visualize_tab:
     st.header("Progress Over Time")
     
     # Calorie Visualization
-    calorie_file = "calorie_data.csv"
-    calorie_columns = ['date', 'calories_consumed', 'calories_burned']
-    calorie_data = load_data(calorie_file, calorie_columns)
+    calorie_fig = build_calorie_fig(file_signature(CALORIE_FILE))
     
-    if not calorie_data.empty:
-        calorie_data['date'] = pd.to_datetime(calorie_data['date'])
-        fig = px.line(calorie_data, x='date', y=['calories_consumed', 'calories_burned'], 
-                      title="Calorie Tracking Over Time", markers=True)
-        st.plotly_chart(fig, use_container_width=True)
+    if calorie_fig is not None:
+        st.plotly_chart(calorie_fig, use_container_width=True)
     else:
         st.warning("No calorie data available. Please log your activity in Daily Tracking.")
     # Exercise Visualization
-    exercise_file = "exercise_data.csv"
-    exercise_columns = ['date', 'exercise_type', 'duration']
-    exercise_data = load_data(exercise_file, exercise_columns)
+    exercise_fig = build_exercise_fig(file_signature(EXERCISE_FILE))
     
-    if not exercise_data.empty:
-        exercise_data['date'] = pd.to_datetime(exercise_data['date'])
-        fig = px.bar(exercise_data, x='date', y='duration', color='exercise_type', 
-                     title="Exercise Duration Over Time")
-        st.plotly_chart(fig, use_container_width=True)
+    if exercise_fig is not None:
+        st.plotly_chart(exercise_fig, use_container_width=True)
     
     # Water Intake Visualization
-    water_file = "water_data.csv"
-    water_columns = ['date', 'glasses']
-    water_data = load_data(water_file, water_columns)
+    water_fig = build_water_fig(file_signature(WATER_FILE))
     
-    if not water_data.empty:
-        water_data['date'] = pd.to_datetime(water_data['date'])
-        fig = px.line(water_data, x='date', y='glasses', 
-                      title="Water Intake Over Time", markers=True)
-        st.plotly_chart(fig, use_container_width=True)
+    if water_fig is not None:
+        st.plotly_chart(water_fig, use_container_width=True)
     else:
         st.warning("No water intake data available. Please log your water intake.")
     
     # Sleep Monitoring Visualization
-    sleep_file = "sleep_data.csv"
-    sleep_columns = ["date", "hours_slept", "sleep_quality"]
-    sleep_data = load_data(sleep_file, sleep_columns)
+    sleep_figs = build_sleep_figs(file_signature(SLEEP_FILE))
     
-    if not sleep_data.empty:
-        sleep_data['date'] = pd.to_datetime(sleep_data['date'])
+    if sleep_figs is not None:
+        fig_hours, fig_quality = sleep_figs
         # Hours Slept Visualization
-        fig_hours = px.line(sleep_data, x='date', y='hours_slept', 
-                            title="Sleep Duration Over Time", markers=True, 
-                            labels={"hours_slept": "Hours Slept"})
         st.plotly_chart(fig_hours, use_container_width=True)
         
         # Sleep Quality Visualization
-        fig_quality = px.line(sleep_data, x='date', y='sleep_quality', 
-                              title="Sleep Quality Over Time", markers=True, 
-                              labels={"sleep_quality": "Quality (1-5)"})
         st.plotly_chart(fig_quality, use_container_width=True)
     else:
         st.warning("No sleep data available. Please log your sleep details in Daily Tracking.")
\ No newline at end of file